@@ -10,11 +10,15 @@ description: 提供增强的跨API视觉路由能力，解决不同API之间切
 
 from pydantic import BaseModel, Field, validator
 from typing import Callable, Awaitable, Any, Optional, List, Dict, Union
+import asyncio
+import functools
 import hashlib
-import json
-import copy
+from collections import OrderedDict
 import re
 import logging
+import random
+import sqlite3
+import threading
 import time
 import traceback
 
@@ -26,6 +30,132 @@ from fastapi import Request
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("CrossAPIVisionRouter")
 
+# 重试等待时间上限（秒）
+_MAX_RETRY_DELAY = 30.0
+# 视觉模型延迟EWMA的平滑系数
+_LATENCY_EWMA_ALPHA = 0.3
+# 视觉模型调用失败时计入延迟的惩罚（秒）
+_LATENCY_FAILURE_PENALTY = 30.0
+# 重构消息时保留的内容类型
+_TEXT_PART_TYPES = frozenset({"text", "code"})
+
+class _ProviderMatcher:
+    """
+    根据 providers_map 预编译的提供商匹配正则
+    """
+
+    def __init__(self, providers_map: Dict[str, str]):
+        # 复制映射，避免外部修改影响已缓存的结果
+        self._providers_map = dict(providers_map)
+        # 按 providers_map 顺序排列，靠前的键优先
+        providers = [k for k in self._providers_map if k]
+        self._order = {provider: index for index, provider in enumerate(providers)}
+        if providers:
+            alternation = "|".join(re.escape(provider) for provider in providers)
+            self._prefix_re: Optional[re.Pattern] = re.compile(f"^(?:{alternation})")
+            # 零宽前瞻，可在每个位置找到重叠的匹配
+            self._substr_re: Optional[re.Pattern] = re.compile(f"(?=({alternation}))")
+        else:
+            self._prefix_re = None
+            self._substr_re = None
+
+    def match(self, model_id: str) -> str:
+        """
+        返回模型ID对应的API提供商
+        """
+        if self._prefix_re is None:
+            return "unknown"
+
+        model_id_lower = model_id.lower()
+
+        # 直接匹配完整提供商名称
+        match = self._prefix_re.match(model_id_lower)
+        if match:
+            return self._providers_map[match.group(0)]
+
+        # 部分匹配，取 providers_map 中最靠前的键
+        provider = min(
+            (match.group(1) for match in self._substr_re.finditer(model_id_lower)),
+            key=self._order.__getitem__,
+            default=None
+        )
+        if provider is not None:
+            return self._providers_map[provider]
+
+        return "unknown"
+
+@functools.lru_cache(maxsize=256)
+def _match_api_provider(matcher: _ProviderMatcher, model_id: str) -> str:
+    """
+    缓存提供商识别结果；键包含匹配器，providers_map 变化后旧结果不会被命中
+    """
+    return matcher.match(model_id)
+
+class _EmitterCoalescer:
+    """
+    合并短时间内的状态更新，减少事件发送次数
+    """
+
+    def __init__(
+        self,
+        emitter: Callable[[Any], Awaitable[None]],
+        enabled: bool = True,
+        interval: float = 0.25
+    ):
+        self._emitter = emitter
+        self._enabled = enabled
+        self._interval = interval
+        self._pending: Optional[str] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def update(self, description: str, done: bool = False) -> None:
+        """
+        记录最新状态；done=True 时立即发送
+        """
+        if not self._enabled:
+            return
+
+        if done:
+            self.cancel()
+            await self._emit(description, True)
+            return
+
+        self._pending = description
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after(self._interval))
+
+    def cancel(self) -> None:
+        """
+        丢弃尚未发送的状态
+        """
+        self._pending = None
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    async def _flush_after(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        description, self._pending = self._pending, None
+        if description is not None:
+            await self._emit(description, False)
+        self._flush_task = None
+
+        # 发送期间到达的新状态
+        if self._pending is not None:
+            self._flush_task = asyncio.create_task(self._flush_after(self._interval))
+
+    async def _emit(self, description: str, done: bool) -> None:
+        try:
+            await self._emitter({
+                "type": "status",
+                "data": {
+                    "description": description,
+                    "done": done
+                }
+            })
+        except Exception as e:
+            logger.error(f"发送状态更新时出错: {e}")
+
 class Filter:
     class Valves(BaseModel):
         non_vision_model_ids: List[str] = Field(
@@ -40,6 +170,10 @@ class Filter:
             default="google.gemini-2.0-flash",
             description="备用视觉模型，当主视觉模型失败时使用",
         )
+        vision_model_candidates: List[str] = Field(
+            default_factory=list,
+            description="候选视觉模型列表，设置后按实测延迟优先使用最快的模型，其余作为备用；留空则使用主视觉模型和备用模型",
+        )
         providers_map: Dict[str, str] = Field(
             default_factory=lambda: {
                 "deepseek": "deepseek",
@@ -50,7 +184,7 @@ class Filter:
                 "llama": "ollama",
                 "qwen": "qwen"
             },
-            description="API提供商映射，用于识别不同模型所属的API提供商",
+            description="API提供商映射，用于识别不同模型所属的API提供商；先按前缀匹配，再按包含匹配，多个键匹配时以映射中靠前的键为准",
         )
         image_description_prompt: str = Field(
             default=(
@@ -95,6 +229,30 @@ class Filter:
             default=500,
             description="图像描述缓存的最大条目数"
         )
+        max_concurrent_vision_calls: int = Field(
+            default=4,
+            description="同时进行的视觉模型调用的最大数量"
+        )
+        persistent_cache_path: str = Field(
+            default="",
+            description="持久化图像描述缓存的SQLite数据库文件路径，留空则仅使用内存缓存；提示词或视觉模型变化时自动清空"
+        )
+        persistent_cache_ttl_seconds: int = Field(
+            default=30 * 24 * 3600,
+            description="持久化缓存条目的保留时间（秒）"
+        )
+        max_active_sessions: int = Field(
+            default=1000,
+            description="保留的会话记录最大条目数"
+        )
+        session_ttl_seconds: int = Field(
+            default=3600,
+            description="会话记录的保留时间（秒）"
+        )
+        retry_base_delay: float = Field(
+            default=1.0,
+            description="重试前的基础等待时间（秒），按指数退避并加入随机抖动，设为0则立即重试"
+        )
         
         @validator('providers_map')
         def ensure_lowercase_keys(cls, v):
@@ -103,13 +261,81 @@ class Filter:
 
     def __init__(self):
         self.valves = self.Valves()
-        # 图像描述缓存
-        self.image_description_cache: Dict[str, str] = {}
+        # 图像描述缓存（LRU）
+        self.image_description_cache: "OrderedDict[bytes, str]" = OrderedDict()
+        # 保护缓存修改的锁
+        self._cache_lock = asyncio.Lock()
+        # 持久化缓存数据库，随 persistent_cache_path 变化重新打开
+        self._cache_db: Optional[sqlite3.Connection] = None
+        self._cache_db_path: Optional[str] = None
+        self._cache_db_fingerprint: Optional[bytes] = None
+        self._cache_db_last_purge = 0.0
+        # 数据库操作在工作线程中执行，使用线程锁串行化
+        self._cache_db_lock = threading.Lock()
+        # 生成当前内存缓存描述时使用的配置指纹
+        self._cache_fingerprint: Optional[bytes] = None
         # API状态缓存
         self.api_health_cache: Dict[str, Dict[str, Any]] = {}
+        # 各视觉模型的响应延迟（EWMA，秒）
+        self._provider_latency: Dict[str, float] = {}
         # 处理中的会话记录
-        self.active_sessions: Dict[str, Dict[str, Any]] = {}
+        self.active_sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 非视觉模型ID集合，随 non_vision_model_ids 变化重建
+        self._non_vision_model_ids_ref: Optional[List[str]] = None
+        self._non_vision_model_id_set: frozenset = frozenset()
+        # 提供商匹配器，随 providers_map 变化重建
+        self._providers_map_ref: Optional[Dict[str, str]] = None
+        self._provider_matcher: Optional[_ProviderMatcher] = None
         
+    def _get_non_vision_model_id_set(self) -> frozenset:
+        """
+        获取非视觉模型ID集合，用于O(1)成员检查
+        """
+        model_ids = self.valves.non_vision_model_ids
+        if model_ids is not self._non_vision_model_ids_ref:
+            self._non_vision_model_ids_ref = model_ids
+            self._non_vision_model_id_set = frozenset(model_ids)
+        return self._non_vision_model_id_set
+
+    def _get_vision_model_ids(self) -> List[str]:
+        """
+        获取按优先级排序的视觉模型列表
+        """
+        candidates = [model_id for model_id in dict.fromkeys(self.valves.vision_model_candidates) if model_id]
+        if candidates:
+            # 尚无延迟记录的模型优先尝试
+            return sorted(candidates, key=lambda model_id: self._provider_latency.get(model_id, 0.0))
+
+        vision_model_ids = [self.valves.vision_model_id]
+        if self.valves.fallback_vision_model_id and self.valves.fallback_vision_model_id != self.valves.vision_model_id:
+            vision_model_ids.append(self.valves.fallback_vision_model_id)
+        return vision_model_ids
+
+    def _record_latency(self, vision_model_id: str, elapsed_time: float, failed: bool = False) -> None:
+        """
+        更新视觉模型的延迟EWMA，失败时额外计入惩罚，使其排到后面
+        """
+        if failed:
+            elapsed_time += _LATENCY_FAILURE_PENALTY
+            
+        previous = self._provider_latency.get(vision_model_id)
+        if previous is None:
+            self._provider_latency[vision_model_id] = elapsed_time
+        else:
+            self._provider_latency[vision_model_id] = (
+                _LATENCY_EWMA_ALPHA * elapsed_time + (1 - _LATENCY_EWMA_ALPHA) * previous
+            )
+
+    def _get_provider_matcher(self) -> "_ProviderMatcher":
+        """
+        获取提供商匹配器，providers_map 变化时重新构建
+        """
+        providers_map = self.valves.providers_map
+        if providers_map is not self._providers_map_ref:
+            self._providers_map_ref = providers_map
+            self._provider_matcher = _ProviderMatcher(providers_map)
+        return self._provider_matcher
+
     def get_api_provider(self, model_id: str) -> str:
         """
         根据模型ID识别API提供商
@@ -117,47 +343,40 @@ class Filter:
         if not model_id:
             return "unknown"
             
-        model_id_lower = model_id.lower()
-        
-        # 直接匹配完整提供商名称
-        for provider, mapped_provider in self.valves.providers_map.items():
-            if model_id_lower.startswith(provider):
-                return mapped_provider
-                
-        # 部分匹配
-        for provider, mapped_provider in self.valves.providers_map.items():
-            if provider in model_id_lower:
-                return mapped_provider
-                
-        return "unknown"
+        return _match_api_provider(self._get_provider_matcher(), model_id)
 
-    def get_image_key(self, image_info: Dict[str, Any]) -> Optional[str]:
+    def get_image_key(self, image_info: Dict[str, Any]) -> Optional[bytes]:
         """
         为图像生成唯一键值
         """
         try:
             if image_info.get("type") == "image_url":
                 url = image_info.get("image_url")
-                return str(url) if url else None
+                if not url:
+                    return None
+                return hashlib.blake2b(str(url).encode("utf-8"), digest_size=16).digest()
             elif image_info.get("type") == "image":
                 image_data = image_info.get("image")
                 if image_data is None:
                     return None
 
                 # 处理不同的图像数据类型
+                hasher = hashlib.blake2b(digest_size=16)
                 if isinstance(image_data, bytes):
-                    data = image_data
+                    hasher.update(image_data)
                 elif isinstance(image_data, str):
                     # 对于base64字符串
-                    data = image_data.encode("utf-8")
+                    hasher.update(image_data.encode("utf-8"))
                 elif hasattr(image_data, "read"):
-                    data = image_data.read()
+                    # 分块读取，避免一次性加载整个文件
+                    for chunk in iter(lambda: image_data.read(65536), b""):
+                        hasher.update(chunk)
                     if hasattr(image_data, "seek"):
                         image_data.seek(0)  # 重置文件指针
                 else:
-                    data = str(image_data).encode("utf-8")
+                    hasher.update(str(image_data).encode("utf-8"))
 
-                return hashlib.sha256(data).hexdigest()
+                return hasher.digest()
             return None
         except Exception as e:
             logger.error(f"生成图像键时出错: {e}")
@@ -170,26 +389,38 @@ class Filter:
         从消息中提取所有图像
         """
         images_found = []
+        get_image_key = self.get_image_key
+        
+        def append_image(image_record: Dict[str, Any]) -> None:
+            # 提取时计算图像键，后续处理直接复用
+            image_record["key"] = get_image_key(image_record)
+            images_found.append(image_record)
         
         for idx_message, message in enumerate(messages):
             if message.get("role") != "user":
                 continue
                 
-            content = message.get("content", "")
+            content = message.get("content")
+            images = message.get("images")
+            
+            # 纯文本消息，无需进一步检查
+            if not images and not isinstance(content, list):
+                continue
             
             # 处理列表类型的内容
             if isinstance(content, list):
                 for idx_part, part in enumerate(content):
-                    if part.get("type") == "image":
-                        images_found.append({
+                    part_type = part.get("type")
+                    if part_type == "image":
+                        append_image({
                             "message_index": idx_message,
                             "content_index": idx_part,
                             "type": "image",
                             "image": part.get("image"),
                             "format": "base64"
                         })
-                    elif part.get("type") == "image_url":
-                        images_found.append({
+                    elif part_type == "image_url":
+                        append_image({
                             "message_index": idx_message,
                             "content_index": idx_part,
                             "type": "image_url",
@@ -198,9 +429,9 @@ class Filter:
                         })
             
             # 处理独立图像数组
-            if message.get("images"):
-                for idx_img, img in enumerate(message.get("images", [])):
-                    images_found.append({
+            if images:
+                for idx_img, img in enumerate(images):
+                    append_image({
                         "message_index": idx_message,
                         "image_index": idx_img,
                         "type": "image",
@@ -222,17 +453,15 @@ class Filter:
         """
         content = message.get("content", "")
         
-        # 复制消息，避免修改原始消息
-        normalized_message = copy.deepcopy(message)
+        # 已经是列表格式，无需复制
+        if isinstance(content, list):
+            return message
         
-        # 字符串转换为列表格式
-        if isinstance(content, str):
-            normalized_message["content"] = [{"type": "text", "text": content}]
-        elif not isinstance(content, list):
-            # 其他非列表类型也转换为列表
-            normalized_message["content"] = [{"type": "text", "text": str(content)}]
-            
-        return normalized_message
+        # 字符串及其他非列表类型转换为列表格式，返回新消息，避免修改原始消息
+        return {
+            **message,
+            "content": [{"type": "text", "text": content if isinstance(content, str) else str(content)}]
+        }
 
     def denormalize_message_content(self, message: Dict[str, Any], original_type: str) -> Dict[str, Any]:
         """
@@ -240,18 +469,156 @@ class Filter:
         """
         content = message.get("content", [])
         
-        # 复制消息，避免修改原始消息
-        denormalized_message = copy.deepcopy(message)
-        
-        # 如果原始类型是字符串，且当前是列表格式，则转回字符串
+        # 如果原始类型是字符串，且当前是列表格式，则转回字符串，返回新消息，避免修改原始消息
         if original_type == "string" and isinstance(content, list):
-            text_parts = []
-            for part in content:
-                if part.get("type") == "text":
-                    text_parts.append(part.get("text", ""))
-            denormalized_message["content"] = " ".join(text_parts)
+            text = " ".join([part.get("text", "") for part in content if part.get("type") == "text"])
+            return {**message, "content": text}
             
-        return denormalized_message
+        return message
+
+    def _cache_description(self, image_key: bytes, description: str) -> None:
+        """
+        写入内存缓存，调用方需持有缓存锁
+        """
+        self.image_description_cache[image_key] = description
+        self.image_description_cache.move_to_end(image_key)
+
+        # 如果缓存过大，移除最久未使用的条目
+        while self.image_description_cache and len(self.image_description_cache) > self.valves.max_cache_size:
+            self.image_description_cache.popitem(last=False)
+
+    def _get_description_fingerprint(self) -> bytes:
+        """
+        生成影响图像描述内容的配置指纹（提示词与视觉模型）
+        """
+        parts = [
+            self.valves.image_description_prompt,
+            self.valves.vision_model_id,
+            self.valves.fallback_vision_model_id,
+            *self.valves.vision_model_candidates,
+        ]
+        return hashlib.blake2b("\x00".join(parts).encode("utf-8"), digest_size=16).digest()
+
+    def _get_cache_db(self, fingerprint: bytes) -> Optional[sqlite3.Connection]:
+        """
+        获取持久化缓存数据库连接，未配置路径时返回None；调用方需持有数据库锁
+        """
+        path = self.valves.persistent_cache_path
+        if path != self._cache_db_path:
+            # 路径变化时关闭旧连接
+            if self._cache_db is not None:
+                self._cache_db.close()
+            self._cache_db = None
+            self._cache_db_path = path
+            self._cache_db_fingerprint = None
+            self._cache_db_last_purge = 0.0
+
+            if path:
+                try:
+                    db = sqlite3.connect(path, check_same_thread=False)
+                    with db:
+                        db.execute(
+                            "CREATE TABLE IF NOT EXISTS image_description_cache "
+                            "(k BLOB PRIMARY KEY, v TEXT NOT NULL, ts INTEGER NOT NULL)"
+                        )
+                        db.execute(
+                            "CREATE TABLE IF NOT EXISTS image_description_cache_meta "
+                            "(name TEXT PRIMARY KEY, value BLOB NOT NULL)"
+                        )
+                    self._cache_db = db
+                except sqlite3.Error as e:
+                    logger.error(f"打开持久化缓存数据库失败: {e}")
+
+        db = self._cache_db
+        if db is None or fingerprint == self._cache_db_fingerprint:
+            return db
+
+        # 提示词或视觉模型变化后，清空旧的描述
+        try:
+            row = db.execute(
+                "SELECT value FROM image_description_cache_meta WHERE name = 'fingerprint'"
+            ).fetchone()
+            if row is None or row[0] != fingerprint:
+                with db:
+                    db.execute("DELETE FROM image_description_cache")
+                    db.execute(
+                        "INSERT OR REPLACE INTO image_description_cache_meta (name, value) VALUES ('fingerprint', ?)",
+                        (fingerprint,)
+                    )
+            self._cache_db_fingerprint = fingerprint
+        except sqlite3.Error as e:
+            logger.error(f"更新持久化缓存指纹失败: {e}")
+            return None
+
+        return db
+
+    def _load_persistent_descriptions_sync(self, image_keys: List[bytes], fingerprint: bytes) -> Dict[bytes, str]:
+        """
+        从持久化缓存读取未过期的图像描述，在工作线程中执行
+        """
+        descriptions = {}
+        with self._cache_db_lock:
+            db = self._get_cache_db(fingerprint)
+            if db is None:
+                return descriptions
+
+            expire_before = int(time.time()) - self.valves.persistent_cache_ttl_seconds
+            try:
+                # 分批查询，避免超出SQLite参数数量限制
+                for start in range(0, len(image_keys), 500):
+                    batch = image_keys[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = db.execute(
+                        f"SELECT k, v FROM image_description_cache WHERE k IN ({placeholders}) AND ts >= ?",
+                        (*batch, expire_before)
+                    ).fetchall()
+                    descriptions.update(rows)
+            except sqlite3.Error as e:
+                logger.error(f"读取持久化缓存失败: {e}")
+
+        return descriptions
+
+    def _save_persistent_descriptions_sync(self, descriptions: Dict[bytes, str], fingerprint: bytes) -> None:
+        """
+        写入持久化缓存，并定期清理过期条目，在工作线程中执行
+        """
+        with self._cache_db_lock:
+            db = self._get_cache_db(fingerprint)
+            if db is None:
+                return
+
+            now = time.time()
+            try:
+                with db:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO image_description_cache (k, v, ts) VALUES (?, ?, ?)",
+                        [(image_key, description, int(now)) for image_key, description in descriptions.items()]
+                    )
+                    # 每小时最多清理一次
+                    if now - self._cache_db_last_purge > 3600:
+                        db.execute(
+                            "DELETE FROM image_description_cache WHERE ts < ?",
+                            (int(now) - self.valves.persistent_cache_ttl_seconds,)
+                        )
+                        self._cache_db_last_purge = now
+            except sqlite3.Error as e:
+                logger.error(f"写入持久化缓存失败: {e}")
+
+    async def _load_persistent_descriptions(self, image_keys: List[bytes], fingerprint: bytes) -> Dict[bytes, str]:
+        """
+        从持久化缓存读取图像描述，数据库操作不阻塞事件循环
+        """
+        if not self.valves.persistent_cache_path and self._cache_db is None:
+            return {}
+        return await asyncio.to_thread(self._load_persistent_descriptions_sync, image_keys, fingerprint)
+
+    async def _save_persistent_descriptions(self, descriptions: Dict[bytes, str], fingerprint: bytes) -> None:
+        """
+        写入持久化缓存，数据库操作不阻塞事件循环
+        """
+        if not self.valves.persistent_cache_path and self._cache_db is None:
+            return
+        await asyncio.to_thread(self._save_persistent_descriptions_sync, descriptions, fingerprint)
 
     async def process_images_with_vision_model(
         self,
@@ -259,115 +626,155 @@ class Filter:
         __event_emitter__: Callable[[Any], Awaitable[None]],
         __user__: Optional[Dict[str, Any]],
         __request__: Optional[Request],
-    ) -> Dict[str, str]:
+    ) -> Dict[bytes, str]:
         """
         使用视觉模型处理图像
         """
         results = {}
         cached_images = 0
-        processed_images = 0
         
-        # 检查缓存中已有的图像
+        # 预先计算图像键并去重，每张图像只哈希一次
+        unique_images: Dict[bytes, Dict[str, Any]] = {}
         for image_info in images:
-            image_key = self.get_image_key(image_info)
-            if not image_key:
-                continue
-                
-            if image_key in self.image_description_cache:
-                results[image_key] = self.image_description_cache[image_key]
-                cached_images += 1
-            else:
-                processed_images += 1
-                
-        # 发送初始状态消息
-        if self.valves.status_updates and images:
-            status_message = f"找到 {len(images)} 张图片"
-            if cached_images > 0:
-                status_message += f"（其中 {cached_images} 张从缓存加载）"
-            if processed_images > 0:
-                status_message += f", 正在使用 {self.valves.vision_model_id} 处理 {processed_images} 张新图片"
-            await __event_emitter__({
-                "type": "status",
-                "data": {
-                    "description": status_message,
-                    "done": False
-                }
-            })
+            image_key = image_info["key"] if "key" in image_info else self.get_image_key(image_info)
+            if image_key and image_key not in unique_images:
+                unique_images[image_key] = image_info
         
-        # 处理未缓存的图像
-        image_count = 0
-        for image_info in images:
-            image_key = self.get_image_key(image_info)
-            if not image_key or image_key in results:
-                continue
+        # 检查缓存中已有的图像，收集未缓存的图像
+        fingerprint = self._get_description_fingerprint()
+        pending_images: Dict[bytes, Dict[str, Any]] = {}
+        async with self._cache_lock:
+            # 提示词或视觉模型变化后，旧的描述不再有效
+            if fingerprint != self._cache_fingerprint:
+                self.image_description_cache.clear()
+                self._cache_fingerprint = fingerprint
+
+            for image_key, image_info in unique_images.items():
+                if image_key in self.image_description_cache:
+                    self.image_description_cache.move_to_end(image_key)
+                    results[image_key] = self.image_description_cache[image_key]
+                    cached_images += 1
+                else:
+                    pending_images[image_key] = image_info
+
+        # 内存未命中时查询持久化缓存
+        if pending_images:
+            stored_descriptions = await self._load_persistent_descriptions(list(pending_images), fingerprint)
+            if stored_descriptions:
+                async with self._cache_lock:
+                    for image_key, description in stored_descriptions.items():
+                        pending_images.pop(image_key)
+                        results[image_key] = description
+                        if fingerprint == self._cache_fingerprint:
+                            self._cache_description(image_key, description)
+                        cached_images += 1
                 
-            image_count += 1
-            
-            # 尝试使用主视觉模型
-            description = await self._process_single_image(
-                image_info, 
-                self.valves.vision_model_id,
-                __event_emitter__,
-                __user__,
-                __request__,
-                image_count,
-                processed_images
+        # 本次调用使用的视觉模型顺序
+        vision_model_ids = self._get_vision_model_ids()
+
+        status_emitter = _EmitterCoalescer(__event_emitter__, self.valves.status_updates)
+        try:
+            # 发送初始状态消息
+            if images:
+                status_message = f"找到 {len(images)} 张图片"
+                if cached_images > 0:
+                    status_message += f"（其中 {cached_images} 张从缓存加载）"
+                if pending_images:
+                    status_message += f", 正在使用 {vision_model_ids[0]} 处理 {len(pending_images)} 张新图片"
+                await status_emitter.update(status_message)
+
+            # 所有图像共享的提示部分和用户对象
+            prompt_part = {"type": "text", "text": self.valves.image_description_prompt}
+            user_obj = None
+            user_lookup_failed = False
+            if pending_images and __user__ and "id" in __user__:
+                try:
+                    user_obj = Users.get_user_by_id(__user__["id"])
+                except Exception as e:
+                    # 无法获取用户时跳过视觉处理，图像使用默认描述
+                    user_lookup_failed = True
+                    logger.error(f"获取用户信息时出错: {e}")
+                    if self.valves.debug_mode:
+                        logger.error(traceback.format_exc())
+
+            semaphore = asyncio.Semaphore(max(1, self.valves.max_concurrent_vision_calls))
+
+            async def describe_image(image_info: Dict[str, Any], image_count: int) -> Optional[str]:
+                if user_lookup_failed:
+                    return None
+
+                # 按顺序尝试视觉模型，失败时使用下一个备用模型
+                description = None
+                for model_index, vision_model_id in enumerate(vision_model_ids):
+                    if model_index > 0 and self.valves.debug_mode:
+                        logger.info(f"图像 {image_count} 视觉模型处理失败，尝试备用模型 {vision_model_id}")
+
+                    description = await self._process_single_image(
+                        image_info,
+                        vision_model_id,
+                        prompt_part,
+                        status_emitter,
+                        semaphore,
+                        user_obj,
+                        __request__,
+                        image_count,
+                        len(pending_images)
+                    )
+                    if description:
+                        break
+
+                return description
+
+            # 并发处理未缓存的图像
+            results_list = await asyncio.gather(
+                *(
+                    describe_image(image_info, image_count)
+                    for image_count, image_info in enumerate(pending_images.values(), start=1)
+                ),
+                return_exceptions=True
             )
-            
-            # 如果主模型失败，尝试使用备用模型
-            if not description and self.valves.vision_model_id != self.valves.fallback_vision_model_id:
-                if self.valves.status_updates:
-                    await __event_emitter__({
-                        "type": "status",
-                        "data": {
-                            "description": f"主视觉模型处理失败，尝试备用模型 {self.valves.fallback_vision_model_id}",
-                            "done": False
-                        }
-                    })
-                    
-                description = await self._process_single_image(
-                    image_info,
-                    self.valves.fallback_vision_model_id,
-                    __event_emitter__,
-                    __user__,
-                    __request__,
-                    image_count,
-                    processed_images
+
+            new_descriptions: Dict[bytes, str] = {}
+            for image_key, description in zip(pending_images, results_list):
+                if isinstance(description, BaseException):
+                    logger.error(f"处理图像时出错: {description}")
+                    description = None
+
+                # 存储结果，即使是失败的结果也存储，避免重复尝试失败的图像
+                if description:
+                    results[image_key] = description
+                    new_descriptions[image_key] = description
+                    async with self._cache_lock:
+                        if fingerprint == self._cache_fingerprint:
+                            self._cache_description(image_key, description)
+                else:
+                    # 使用默认描述
+                    default_desc = "图像处理失败，无法生成描述。"
+                    results[image_key] = default_desc
+
+            # 写入持久化缓存，配置已变化时丢弃旧配置生成的描述
+            if new_descriptions and fingerprint == self._cache_fingerprint:
+                await self._save_persistent_descriptions(new_descriptions, fingerprint)
+
+            # 发送最终状态消息
+            if images:
+                await status_emitter.update(
+                    f"图像处理完成: 替换了 {len(images)} 张图片 ({cached_images} 张来自缓存)",
+                    done=True
                 )
-            
-            # 存储结果，即使是失败的结果也存储，避免重复尝试失败的图像
-            if description:
-                results[image_key] = description
-                self.image_description_cache[image_key] = description
-                
-                # 如果缓存过大，移除最早的条目
-                if len(self.image_description_cache) > self.valves.max_cache_size:
-                    # 简单的LRU实现 - 删除第一个键
-                    oldest_key = next(iter(self.image_description_cache))
-                    self.image_description_cache.pop(oldest_key)
-            else:
-                # 使用默认描述
-                default_desc = "图像处理失败，无法生成描述。"
-                results[image_key] = default_desc
-                
-        # 发送最终状态消息
-        if self.valves.status_updates and images:
-            await __event_emitter__({
-                "type": "status",
-                "data": {
-                    "description": f"图像处理完成: 替换了 {len(images)} 张图片 ({cached_images} 张来自缓存)",
-                    "done": True
-                }
-            })
-            
+        finally:
+            status_emitter.cancel()
+
         return results
 
     async def _process_single_image(
         self,
         image_info: Dict[str, Any],
         vision_model_id: str,
-        __event_emitter__: Callable[[Any], Awaitable[None]],
-        __user__: Optional[Dict[str, Any]],
+        prompt_part: Dict[str, Any],
+        status_emitter: "_EmitterCoalescer",
+        semaphore: asyncio.Semaphore,
+        user_obj: Any,
         __request__: Optional[Request],
         image_count: int,
         total_images: int
@@ -375,109 +782,74 @@ class Filter:
         """
         处理单个图像
         """
+        # 准备图像部分
+        if image_info.get("type") == "image_url" and image_info.get("image_url"):
+            image_part = {
+                "type": "image_url",
+                "image_url": image_info.get("image_url")
+            }
+        elif image_info.get("type") == "image" and image_info.get("image"):
+            image_part = {
+                "type": "image",
+                "image": image_info.get("image")
+            }
+        else:
+            if self.valves.debug_mode:
+                logger.warning(f"跳过无效图像数据: {image_info.get('type')}")
+            return None
+
         retry_count = 0
         max_retries = self.valves.max_retry_count
+        process_start_time = time.time()
         
         while retry_count <= max_retries:
             try:
-                # 准备图像部分
-                if image_info.get("type") == "image_url" and image_info.get("image_url"):
-                    image_part = {
-                        "type": "image_url",
-                        "image_url": image_info.get("image_url")
-                    }
-                elif image_info.get("type") == "image" and image_info.get("image"):
-                    image_part = {
-                        "type": "image",
-                        "image": image_info.get("image")
-                    }
-                else:
-                    if self.valves.debug_mode:
-                        logger.warning(f"跳过无效图像数据: {image_info.get('type')}")
-                    return None
-                
-                # 构建消息
-                messages_to_vision_model = [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": self.valves.image_description_prompt
-                            },
-                            image_part
-                        ]
-                    }
-                ]
-                
-                # 准备请求
+                # 准备请求；外层结构每次重新构建，避免上一次调用对其的修改影响重试
                 payload = {
                     "model": vision_model_id,
-                    "messages": messages_to_vision_model,
+                    "messages": [
+                        {
+                            "role": "user",
+                            "content": [prompt_part, image_part]
+                        }
+                    ],
                     "stream": False
                 }
                 
-                # 获取用户对象
-                user_obj = Users.get_user_by_id(__user__["id"]) if __user__ and "id" in __user__ else None
-                
                 # 发送状态更新
-                if self.valves.status_updates:
-                    await __event_emitter__({
-                        "type": "status",
-                        "data": {
-                            "description": f"正在处理图像 {image_count}/{total_images}...",
-                            "done": False
-                        }
-                    })
+                await status_emitter.update(f"正在处理图像 {image_count}/{total_images}...")
                 
-                # 调用API
-                start_time = time.time()
-                response = await generate_chat_completion(
-                    request=__request__,
-                    form_data=payload,
-                    user=user_obj
-                )
-                elapsed_time = time.time() - start_time
+                # 调用API，仅在调用期间占用并发名额，重试等待时释放
+                async with semaphore:
+                    start_time = time.time()
+                    response = await generate_chat_completion(
+                        request=__request__,
+                        form_data=payload,
+                        user=user_obj
+                    )
+                    elapsed_time = time.time() - start_time
                 
                 # 提取结果
                 content = response["choices"][0]["message"]["content"]
                 
                 if content:
+                    self._record_latency(vision_model_id, elapsed_time)
                     word_count = len(content.split())
                     
                     # 发送状态更新
-                    if self.valves.status_updates:
-                        await __event_emitter__({
-                            "type": "status",
-                            "data": {
-                                "description": f"图像 {image_count} 处理完成: {word_count} 个描述词 ({elapsed_time:.2f}秒)",
-                                "done": False
-                            }
-                        })
+                    await status_emitter.update(f"图像 {image_count} 处理完成: {word_count} 个描述词 ({elapsed_time:.2f}秒)")
                     
                     return content
                 else:
                     retry_count += 1
                     if retry_count <= max_retries:
                         # 发送重试状态
-                        if self.valves.status_updates:
-                            await __event_emitter__({
-                                "type": "status",
-                                "data": {
-                                    "description": f"图像 {image_count} 处理未返回内容，重试 {retry_count}/{max_retries}",
-                                    "done": False
-                                }
-                            })
+                        await status_emitter.update(f"图像 {image_count} 处理未返回内容，重试 {retry_count}/{max_retries}")
+                        await self._wait_before_retry(retry_count)
                     else:
                         # 发送失败状态
-                        if self.valves.status_updates:
-                            await __event_emitter__({
-                                "type": "status",
-                                "data": {
-                                    "description": f"图像 {image_count} 处理失败，无法生成描述",
-                                    "done": False
-                                }
-                            })
+                        await status_emitter.update(f"图像 {image_count} 处理失败，无法生成描述")
+                        self._record_latency(vision_model_id, time.time() - process_start_time, failed=True)
                         return None
                         
             except Exception as e:
@@ -490,32 +862,31 @@ class Filter:
                 
                 if retry_count <= max_retries:
                     # 发送重试状态
-                    if self.valves.status_updates:
-                        await __event_emitter__({
-                            "type": "status",
-                            "data": {
-                                "description": f"图像 {image_count} 处理错误: {error_msg[:50]}..., 重试 {retry_count}/{max_retries}",
-                                "done": False
-                            }
-                        })
+                    await status_emitter.update(f"图像 {image_count} 处理错误: {error_msg[:50]}..., 重试 {retry_count}/{max_retries}")
+                    await self._wait_before_retry(retry_count)
                 else:
                     # 发送失败状态
-                    if self.valves.status_updates:
-                        await __event_emitter__({
-                            "type": "status",
-                            "data": {
-                                "description": f"图像 {image_count} 处理失败: {error_msg[:50]}...",
-                                "done": False
-                            }
-                        })
+                    await status_emitter.update(f"图像 {image_count} 处理失败: {error_msg[:50]}...")
+                    self._record_latency(vision_model_id, time.time() - process_start_time, failed=True)
                     return None
                     
         return None
 
+    async def _wait_before_retry(self, retry_count: int) -> None:
+        """
+        重试前等待，使用带随机抖动的指数退避
+        """
+        base_delay = self.valves.retry_base_delay
+        if base_delay <= 0:
+            return
+            
+        delay = base_delay * (2 ** (retry_count - 1)) * (1 + random.random() * 0.5)
+        await asyncio.sleep(min(_MAX_RETRY_DELAY, delay))
+
     def reconstruct_messages(
         self, 
         messages: List[Dict[str, Any]], 
-        image_descriptions: Dict[str, str],
+        image_descriptions: Dict[bytes, str],
         images_found: List[Dict[str, Any]]
     ) -> List[Dict[str, Any]]:
         """
@@ -529,12 +900,13 @@ class Filter:
                 images_by_message[msg_idx] = []
             images_by_message[msg_idx].append(img)
         
-        # 复制消息列表，避免修改原始数据
-        reconstructed_messages = copy.deepcopy(messages)
+        # 构建新的消息列表，仅复制需要修改的消息，避免修改原始数据
+        reconstructed_messages = []
         
         # 处理每条消息
-        for msg_idx, message in enumerate(reconstructed_messages):
+        for msg_idx, message in enumerate(messages):
             if msg_idx not in images_by_message or message.get("role") != "user":
+                reconstructed_messages.append(message)
                 continue
             
             # 提取该消息中的所有图像
@@ -545,39 +917,41 @@ class Filter:
             normalized_message = self.normalize_message_content(message)
             content_list = normalized_message.get("content", [])
             
-            # 创建新的内容列表
-            new_content = []
+            # 添加图像描述，使用模板格式化
+            context_template = self.valves.image_context_template
+            description_parts = [
+                {"type": "text", "text": context_template.format(description=image_descriptions[img["key"]])}
+                for img in imgs
+                if img.get("key") in image_descriptions
+            ]
             
-            # 添加图像描述
-            for img_idx, img in enumerate(imgs):
-                image_key = self.get_image_key(img)
-                if not image_key or image_key not in image_descriptions:
-                    continue
-                
-                description = image_descriptions[image_key]
-                
-                # 使用模板格式化描述
-                context_text = self.valves.image_context_template.format(
-                    description=description
-                )
-                
-                # 添加到新内容
-                new_content.append({"type": "text", "text": context_text})
+            # 保留原始文本内容（过滤掉图像）
+            text_parts = [part for part in content_list if part.get("type") in _TEXT_PART_TYPES]
             
-            # 添加原始文本内容（过滤掉图像）
-            for part in content_list:
-                if part.get("type") in ["text", "code"]:
-                    new_content.append(part)
+            new_content = description_parts + text_parts
             
             # 更新消息内容
-            message["content"] = new_content
+            new_message = dict(message)
+            new_message["content"] = new_content
             
             # 删除独立图像数组
-            if "images" in message:
-                message.pop("images")
+            new_message.pop("images", None)
+            
+            reconstructed_messages.append(new_message)
         
         return reconstructed_messages
 
+    def _prune_active_sessions(self) -> None:
+        """
+        移除过期或超出数量上限的会话记录
+        """
+        expire_before = time.time() - self.valves.session_ttl_seconds
+        while self.active_sessions and (
+            len(self.active_sessions) > self.valves.max_active_sessions
+            or next(iter(self.active_sessions.values()))["timestamp"] < expire_before
+        ):
+            self.active_sessions.popitem(last=False)
+
     def get_content_format(self, messages: List[Dict[str, Any]]) -> Dict[int, str]:
         """
         检测每条消息的内容格式类型
@@ -608,25 +982,29 @@ class Filter:
         """
         try:
             # 检查是否需要处理
-            if not __model__ or "id" not in __model__ or __model__["id"] not in self.valves.non_vision_model_ids:
+            if not __model__ or "id" not in __model__ or __model__["id"] not in self._get_non_vision_model_id_set():
                 return body
             
-            # 复制请求体，避免修改原始数据
-            processed_body = copy.deepcopy(body)
-            messages = processed_body.get("messages", [])
-            
-            # 生成会话ID
-            session_id = hashlib.md5(json.dumps(processed_body).encode()).hexdigest()
-            
-            # 记录内容格式
-            content_formats = self.get_content_format(messages)
-            
-            # 提取图像
+            # 先在原始请求上检查图像，没有图像时直接返回
+            messages = body.get("messages", [])
             images_found = self.extract_images_from_messages(messages)
             
             if not images_found:
                 return body  # 没有图像，无需处理
             
+            # 浅复制请求体，消息列表在重构时重新生成，避免修改原始数据
+            processed_body = {**body}
+            
+            # 生成会话ID（仅使用轻量字段，避免序列化整个请求体）
+            user_id = __user__.get("id", "") if __user__ else ""
+            session_id = hashlib.blake2b(
+                f"{user_id}|{__model__['id']}|{len(messages)}|{time.time_ns()}".encode(),
+                digest_size=8
+            ).hexdigest()
+            
+            # 记录内容格式
+            content_formats = self.get_content_format(messages)
+            
             # 处理图像
             image_descriptions = await self.process_images_with_vision_model(
                 images_found,
@@ -646,6 +1024,8 @@ class Filter:
                 "content_formats": content_formats,
                 "timestamp": time.time()
             }
+            self.active_sessions.move_to_end(session_id)
+            self._prune_active_sessions()
             
             return processed_body
             